@@ -1,93 +1,115 @@
+import logging
 import os
-from dotenv import load_dotenv
-from fastapi.responses import RedirectResponse
+from urllib.parse import quote
 
-# --- Load .env before imports using it ---
-if os.path.exists(".env"):
+# --- Load .env before imports using it (Render sets RENDER, so skip the stat and import there) ---
+if not os.getenv("RENDER") and os.path.exists(".env"):
+    from dotenv import load_dotenv
     load_dotenv()
     print("📦 Loaded .env file for local run")
 else:
     print("🚀 Running in Render environment (no .env file)")
 
 from fastapi import FastAPI, Request
-from fastapi.responses import RedirectResponse, HTMLResponse
+from fastapi.responses import HTMLResponse, ORJSONResponse
+from starlette.types import Receive, Scope, Send
 from saml_auth_service import saml_auth_service
 
+logger = logging.getLogger(__name__)
+
 # --- Initialize FastAPI ---
-app = FastAPI(title="Simple SAML Service Provider")
+app = FastAPI(title="Simple SAML Service Provider", default_response_class=ORJSONResponse)
 
 # --- Home Page ---
-@app.get("/", response_class=HTMLResponse)
-async def home(request: Request):
-    access_token = request.cookies.get("access_token")
-    refresh_token = request.cookies.get("refresh_token")
-
-    print("Access Token:", access_token)
-    print("Refresh Token:", refresh_token)
-
-    if access_token:
-        return """
+# Both variants are encoded once; Response.render passes bytes through untouched.
+_HOME_LOGGED_IN = """
         <h1>Welcome Back!</h1>
         <p>You’re already logged in (access token found).</p>
         <a href="/logout"><button>Logout</button></a>
-        """
-    else:
-        return """
+        """.encode()
+_HOME_LOGGED_OUT = """
         <h1>SAML Authentication Test</h1>
         <p>Click below to log in using your SAML provider.</p>
         <a href="/login"><button>Login with SAML</button></a><br><br>
-        """
+        """.encode()
+
+@app.get("/", response_class=HTMLResponse)
+async def home(request: Request):
+    if request.cookies.get("access_token"):
+        return HTMLResponse(_HOME_LOGGED_IN)
+    else:
+        return HTMLResponse(_HOME_LOGGED_OUT)
 
 # --- Logout Route ---
-@app.get("/logout")
-async def logout():
+# Status, location and the expired cookies are constant, so the whole response
+# is pre-baked and sent without constructing a Response object. As a plain
+# ASGI route it is not listed in the OpenAPI schema (see SAML Login below).
+_LOGOUT_HEADERS = [
+    (b"location", b"/"),
+    (b"content-length", b"0"),
+    (b"set-cookie", b'access_token=""; expires=Thu, 01 Jan 1970 00:00:00 GMT; Max-Age=0; Path=/; SameSite=lax'),
+    (b"set-cookie", b'refresh_token=""; expires=Thu, 01 Jan 1970 00:00:00 GMT; Max-Age=0; Path=/; SameSite=lax'),
+]
+
+class Logout:
     """
     Clears cookies and redirects to the home page.
     """
-    response = RedirectResponse(url="/", status_code=303)
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        await send({"type": "http.response.start", "status": 303, "headers": _LOGOUT_HEADERS})
+        await send({"type": "http.response.body", "body": b""})
+        logger.debug("[Logout] Cleared cookies and redirected to home.")
 
-    # Clear both tokens
-    response.delete_cookie("access_token")
-    response.delete_cookie("refresh_token")
-
-    print("[Logout] Cleared cookies and redirected to home.")
-    return response
+app.add_route("/logout", Logout(), methods=["GET"])
 
 # --- SAML Login ---
-@app.get("/login")
-async def saml_login(request: Request):
-    redirect_url = saml_auth_service.initiate_login(request)
-    return RedirectResponse(redirect_url)
+# Login and ACS are mounted as plain ASGI apps so the hot SSO path skips the
+# per-call Request/Response wrappers FastAPI builds around decorated handlers.
+# Routes added with app.add_route (/logout, /login, /acs) are not FastAPI
+# APIRoutes, so they do not appear in /openapi.json or /docs.
+# Same escaping RedirectResponse applies, so non-ASCII IdP URLs go out percent-encoded.
+_URL_SAFE = ":/%#?=@[]!$&'()*+,;"
+
+class SamlLogin:
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        redirect_url = saml_auth_service.initiate_login(scope)
+        await send({
+            "type": "http.response.start",
+            "status": 302,
+            "headers": [(b"location", quote(redirect_url, safe=_URL_SAFE).encode("latin-1")), (b"content-length", b"0")],
+        })
+        await send({"type": "http.response.body", "body": b""})
+
+app.add_route("/login", SamlLogin(), methods=["GET"])
 
 # --- Assertion Consumer Service (ACS) ---
-@app.post("/acs")
-async def saml_assertion(request: Request):
-    tokens = await saml_auth_service.process_assertion(request)
-
-    redirect_url = "https://saml-auth-test.onrender.com/"
-    response = RedirectResponse(url=redirect_url, status_code=303)
-
-    response.set_cookie(
-        key="access_token",
-        value=tokens["access_token"],
-        httponly=True,
-        secure=True,
-        samesite="None",
-        max_age=3600
-    )
-    response.set_cookie(
-        key="refresh_token",
-        value=tokens["refresh_token"],
-        httponly=True,
-        secure=True,
-        samesite="None",
-        max_age=7 * 24 * 3600
-    )
-    return response
+# Cookie attributes never change, so the Set-Cookie suffixes are built once
+# instead of going through set_cookie's SimpleCookie round trip per login.
+_ACS_REDIRECT_URL = b"https://saml-auth-test.onrender.com/"
+_ACCESS_COOKIE_ATTRS = b"; HttpOnly; Max-Age=3600; Path=/; SameSite=None; Secure"
+_REFRESH_COOKIE_ATTRS = b"; HttpOnly; Max-Age=%d; Path=/; SameSite=None; Secure" % (7 * 24 * 3600)
+
+class SamlAssertion:
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        tokens = await saml_auth_service.process_assertion(Request(scope, receive))
+
+        await send({
+            "type": "http.response.start",
+            "status": 303,
+            "headers": [
+                (b"location", _ACS_REDIRECT_URL),
+                (b"content-length", b"0"),
+                (b"set-cookie", b"access_token=" + tokens["access_token"].encode() + _ACCESS_COOKIE_ATTRS),
+                (b"set-cookie", b"refresh_token=" + tokens["refresh_token"].encode() + _REFRESH_COOKIE_ATTRS),
+            ],
+        })
+        await send({"type": "http.response.body", "body": b""})
+
+app.add_route("/acs", SamlAssertion(), methods=["POST"])
 
 @app.get("/health")
 async def health():
-    return {"status": "ok"}
+    return ORJSONResponse({"status": "ok"})
 
 # --- Run locally ---
 if __name__ == "__main__":
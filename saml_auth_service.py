@@ -1,8 +1,65 @@
+import logging
 import os
+from collections.abc import Mapping
+from functools import cache, cached_property
+from os.path import dirname, join
+from urllib.parse import parse_qsl
 from fastapi import HTTPException, status, Request
+from lxml import etree
+from onelogin.saml2 import xml_utils
 from onelogin.saml2.auth import OneLogin_Saml2_Auth
+from onelogin.saml2.settings import OneLogin_Saml2_Settings
+from onelogin.saml2.xml_utils import OneLogin_Saml2_XML
+from starlette.types import Scope
 from test_service import test_service
 
+logger = logging.getLogger(__name__)
+
+# --- Upper bound for an ACS POST body; real SAML responses are a few KB ---
+MAX_SAML_RESPONSE_BYTES = 1024 * 1024
+
+
+# --- python3-saml parses and compiles the XSD (plus its imports) on every
+# validate_xml call; compile each schema once and reuse it. This mirrors
+# OneLogin_Saml2_XML.validate_xml and its private _schema_class as of the
+# pinned python3-saml==1.16.0 - re-check both when upgrading python3-saml ---
+@cache
+def _load_schema(schema: str):
+    return OneLogin_Saml2_XML._schema_class(etree.parse(join(dirname(xml_utils.__file__), "schemas", schema)))
+
+
+def _validate_xml(xml, schema, debug=False):
+    try:
+        xml = OneLogin_Saml2_XML.to_etree(xml)
+    except Exception as e:
+        logger.debug("[SAML] Could not load XML: %s", e)
+        return "unloaded_xml"
+
+    xmlschema = _load_schema(schema)
+    if not xmlschema.validate(xml):
+        if debug:
+            for error in xmlschema.error_log:
+                logger.debug("[SAML] Schema validation error: %s", error.message)
+        return "invalid_xml"
+    return xml
+
+
+OneLogin_Saml2_XML.validate_xml = staticmethod(_validate_xml)
+
+
+def _get_header(scope: Scope, name: bytes):
+    return next((value for key, value in scope["headers"] if key == name), None)
+
+
+def _request_too_large():
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail={
+            "error": "Request too large",
+            "message": "SAML response exceeds the maximum allowed size."
+        },
+    )
+
 
 class SamlAuthService:
     def __init__(self):
@@ -10,15 +67,27 @@ class SamlAuthService:
         self.acs_url = os.getenv("SAML_SP_ASSERTION_CONSUMER_URL")
         self.idp_entity_id = os.getenv("SAML_IDP_ENTITY_ID")
         self.idp_sso_url = os.getenv("SAML_IDP_SSO_URL")
-        self.idp_cert = os.getenv("SAML_IDP_CERT")
+        # --- PEM is often stored with escaped newlines; normalize once ---
+        self.idp_cert = (os.getenv("SAML_IDP_CERT") or "").replace("\\n", "\n").strip()
+
+    def _prepare_request(self, scope: Scope, post_data: Mapping = None):
+        # --- Read straight from the ASGI scope instead of building URL/Headers wrappers ---
+        https = scope["scheme"] == "https"
+        query_string = scope.get("query_string", b"")
+        host = _get_header(scope, b"host")
+        if host is not None:
+            http_host = host.decode("latin-1")
+            port = http_host.rpartition(":")[2]
+            port = int(port) if port.isdigit() else None
+        else:
+            http_host, port = scope.get("server") or ("", None)
 
-    def _prepare_request(self, request: Request, post_data: dict = None):
         return {
-            "https": "on" if request.url.scheme == "https" else "off",
-            "http_host": request.headers.get("host", request.url.hostname),
-            "server_port": request.url.port or (443 if request.url.scheme == "https" else 80),
-            "script_name": request.url.path,
-            "get_data": dict(request.query_params),
+            "https": "on" if https else "off",
+            "http_host": http_host,
+            "server_port": port or (443 if https else 80),
+            "script_name": scope["path"],
+            "get_data": dict(parse_qsl(query_string.decode("latin-1"), keep_blank_values=True)) if query_string else {},
             "post_data": post_data or {},
         }
 
@@ -52,6 +121,11 @@ class SamlAuthService:
             "nameIdFormat": "urn:oasis:names:tc:SAML:1.1:nameid-format:emailAddress",
         }
 
+    @cached_property
+    def saml_settings(self):
+        # --- Parsed once (cert included) and shared by every login/ACS request ---
+        return OneLogin_Saml2_Settings(self._build_saml_settings(), sp_validation_only=False)
+
     def _extract_email_from_saml(self, auth):
         # --- Known SAML attribute keys for email ---
         email_keys = [
@@ -66,7 +140,7 @@ class SamlAuthService:
         # --- Check all attributes ---
         for key in email_keys:
             values = auth.get_attribute(key)
-            print(f"[SAML] Checking attribute '{key}':", values)
+            logger.debug("[SAML] Checking attribute '%s': %s", key, values)
             if values and len(values) > 0:
                 email_candidate = values[0]
                 if "@" in email_candidate:
@@ -76,39 +150,52 @@ class SamlAuthService:
         nameid = auth.get_nameid()
         return nameid
     
-    def initiate_login(self, request: Request):
-        print("[SSO] Initiating SAML SSO Login")
-        print("Request URL:", str(request.url))
-        print("scheme:", request.url.scheme)
-        print("x-forwarded-proto:", request.headers.get("x-forwarded-proto"))
-
-        print("env SAML_SP_ENTITY_ID:", self.sp_entity_id)
-        print("env SAML_IDP_SSO_URL:", self.idp_sso_url)
-        print("env SAML_IDP_ENTITY_ID:", self.idp_entity_id)
-        print("env SAML_SP_ASSERTION_CONSUMER_URL:", self.acs_url)
-        print("env SAML_IDP_CERT:", self.idp_cert[:30] + "...")
-
-        req_data = self._prepare_request(request)
-        settings = self._build_saml_settings()
-        auth = OneLogin_Saml2_Auth(req_data, old_settings=settings)
+    async def _read_form(self, request: Request) -> Mapping:
+        content_length = _get_header(request.scope, b"content-length")
+        if content_length and content_length.isdigit() and int(content_length) > MAX_SAML_RESPONSE_BYTES:
+            raise _request_too_large()
+
+        # --- Cap the body as it streams in, so chunked uploads are bounded too ---
+        body = bytearray()
+        async for chunk in request.stream():
+            body += chunk
+            if len(body) > MAX_SAML_RESPONSE_BYTES:
+                raise _request_too_large()
+
+        content_type = _get_header(request.scope, b"content-type") or b""
+        if not content_type.lower().startswith(b"application/x-www-form-urlencoded"):
+            # --- Replay the already-bounded body into Starlette's parser (multipart etc.) ---
+            async def receive():
+                return {"type": "http.request", "body": bytes(body), "more_body": False}
+
+            return await Request(request.scope, receive).form()
+
+        # --- IdPs post a couple of urlencoded fields; skip Starlette's FormParser ---
+        try:
+            return dict(parse_qsl(body.decode("latin-1"), keep_blank_values=True, max_num_fields=10))
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail={
+                    "error": "Invalid form data",
+                    "message": "Too many fields in the SAML POST body."
+                },
+            )
+
+    def initiate_login(self, scope: Scope):
+        logger.debug("[SSO] Initiating SAML SSO Login")
+
+        req_data = self._prepare_request(scope)
+        auth = OneLogin_Saml2_Auth(req_data, old_settings=self.saml_settings)
 
         redirect_url = auth.login()
-        print(f"[SSO] Redirecting to IdP: {redirect_url}")
+        logger.debug("[SSO] Redirecting to IdP: %s", redirect_url)
         return redirect_url
 
     async def process_assertion(self, request: Request):
-        print("[ACS] Received POST /acs (SAML Response)")
-        print("Request URL:", str(request.url))
-        print("scheme:", request.url.scheme)
-        print("x-forwarded-proto:", request.headers.get("x-forwarded-proto"))
-
-        print("env SAML_SP_ENTITY_ID:", self.sp_entity_id)
-        print("env SAML_IDP_SSO_URL:", self.idp_sso_url)
-        print("env SAML_IDP_ENTITY_ID:", self.idp_entity_id)
-        print("env SAML_SP_ASSERTION_CONSUMER_URL:", self.acs_url)
-        print("env SAML_IDP_CERT:", self.idp_cert[:30] + "...")
-
-        form = await request.form()
+        logger.debug("[ACS] Received POST /acs (SAML Response)")
+
+        form = await self._read_form(request)
         if "SAMLResponse" not in form:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -118,14 +205,13 @@ class SamlAuthService:
                 },
             )
 
-        req_data = self._prepare_request(request, dict(form))
-        settings = self._build_saml_settings()
-        auth = OneLogin_Saml2_Auth(req_data, old_settings=settings)
+        req_data = self._prepare_request(request.scope, form)
+        auth = OneLogin_Saml2_Auth(req_data, old_settings=self.saml_settings)
         auth.process_response()
         errors = auth.get_errors()
 
         if errors:
-            print("[SAML] Processing errors:", errors)
+            logger.warning("[SAML] Processing errors: %s", errors)
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail={
@@ -143,18 +229,10 @@ class SamlAuthService:
                 },
             )
 
-        attributes = auth.get_attributes()
-        print("[SAML] SAML Attributes:", attributes)
-
-        print("[SAML] email:", auth.get_attribute("email"))
-        print("[SAML] Email:", auth.get_attribute("Email"))
-        print("[SAML] email address:", auth.get_attribute("http://schemas.xmlsoap.org/ws/2005/05/identity/claims/emailaddress"))
-
-        print("query_params:", request.query_params)
-        print("body:", request.body)
+        logger.debug("[SAML] SAML Attributes: %s", auth.get_attributes())
 
         email = self._extract_email_from_saml(auth)
-        print("[SAML] Extracted email:", email)
+        logger.debug("[SAML] Extracted email: %s", email)
         if not email:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -164,7 +242,7 @@ class SamlAuthService:
                 },
             )
 
-        print(f"[SAML] Authenticated user: {email}")
+        logger.debug("[SAML] Authenticated user: %s", email)
         user = test_service.get_auth_user(email)
         if not user:
             raise HTTPException(
@@ -181,7 +259,7 @@ class SamlAuthService:
             auth_type="saml"
         )
 
-        print("[SAML] Authentication successful")
+        logger.debug("[SAML] Authentication successful")
         return {
             "access_token": tokens["access_token"],
             "refresh_token": tokens["refresh_token"],
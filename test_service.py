@@ -6,8 +6,9 @@ class TestService:
         self.test_user_email = os.getenv("TEST_USER_EMAIL")
 
     def create_tokens(self, user_id: str, email: str, auth_type: str):
-        fake_access_token = base64.b64encode(f"{user_id}:{email}:{auth_type}:access:".encode()).decode()
-        fake_refresh_token = base64.b64encode(f"{user_id}:{email}:{auth_type}:refresh".encode()).decode()
+        prefix = f"{user_id}:{email}:{auth_type}:".encode()
+        fake_access_token = base64.b64encode(prefix + b"access:").decode("ascii")
+        fake_refresh_token = base64.b64encode(prefix + b"refresh").decode("ascii")
     
         return {"access_token": fake_access_token, "refresh_token": fake_refresh_token}
     